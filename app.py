@@ -1,11 +1,35 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import numpy as np
-from datetime import datetime, timedelta
+from numba import njit
 import calendar
+import hashlib
+import io
+import os
+import tempfile
+
+SAMPLE_PARQUET_PATH = 'synthetic_pharmacy_data.parquet'
+
+# Columns shown in the transaction preview
+_TXN_PREVIEW_COLS = ('Date', 'PatientID', 'ServiceType', 'MedicationCategory', 'Quantity', 'UnitPrice', 'TotalPrice', 'InsuranceUsed')
+
+# Internal helper columns derived at load time, left out of the download
+_HELPER_COLS = ('Is_Seasonal', 'Has_Insurance_Info', 'TxnClass')
+
+# Dashboard tabs and the data_availability flags they need (any one is enough; empty = always shown)
+_TAB_CONFIGS = (
+    ("Revenue Analysis", ()),
+    ("Prescription vs OTC", ()),
+    ("Top Categories", ()),
+    ("Patient Compliance", ('compliance',)),
+    ("Business Patterns", ('seasonal', 'insurance')),
+    ("Clinical Services", ('clinical',)),
+)
 
 # Set page config
 st.set_page_config(
@@ -148,73 +172,148 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data
-def load_data(file_path_or_buffer):
+def read_raw_data(file_path_or_buffer):
+    """Read a CSV, Excel or Parquet file into a Polars DataFrame"""
+    # Handle both file paths and uploaded files
+    if isinstance(file_path_or_buffer, str):
+        file_name = file_path_or_buffer
+    else:
+        file_name = file_path_or_buffer.name
+    
+    if file_name.endswith('.parquet'):
+        return pl.read_parquet(file_path_or_buffer)
+    elif file_name.endswith('.xlsx'):
+        # Prefer the Rust calamine reader and fall back to openpyxl if it isn't installed
+        try:
+            return pl.read_excel(file_path_or_buffer, engine='calamine', infer_schema_length=None)
+        except ImportError:
+            if hasattr(file_path_or_buffer, 'seek'):
+                file_path_or_buffer.seek(0)
+            return pl.read_excel(file_path_or_buffer, engine='openpyxl', infer_schema_length=None)
+    else:
+        # Infer types from every row so IDs that only turn non-numeric late in the file still load
+        return pl.read_csv(file_path_or_buffer, try_parse_dates=True, infer_schema_length=None)
+
+def ensure_sample_parquet():
+    """Convert the sample data to Parquet once so later loads skip CSV/Excel parsing"""
+    for source in ['synthetic_pharmacy_data.csv', 'synthetic_pharmacy_data.xlsx']:
+        if not os.path.exists(source):
+            continue
+        
+        # Reuse the existing Parquet copy unless the sample has changed since
+        if os.path.exists(SAMPLE_PARQUET_PATH) and os.path.getmtime(SAMPLE_PARQUET_PATH) >= os.path.getmtime(source):
+            return True
+        
+        # Write to a temp file beside the target and swap it in, so a failed or concurrent
+        # conversion never leaves a truncated Parquet file behind
+        fd, tmp_path = tempfile.mkstemp(suffix='.parquet.tmp', dir=os.path.dirname(os.path.abspath(SAMPLE_PARQUET_PATH)))
+        os.close(fd)
+        try:
+            read_raw_data(source).write_parquet(tmp_path, compression='zstd')
+            os.replace(tmp_path, SAMPLE_PARQUET_PATH)
+            return True
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+    
+    return os.path.exists(SAMPLE_PARQUET_PATH)
+
+def category_flag(series, values):
+    """Flag rows of a categorical Series whose value is in values, via a lookup on category codes"""
+    # The extra trailing False slot maps missing values (code -1) to False
+    lookup = np.zeros(len(series.cat.categories) + 1, dtype=bool)
+    lookup[:-1] = series.cat.categories.isin(values)
+    return lookup[series.cat.codes.to_numpy()]
+
+def prepare_data(file_path_or_buffer):
+    """Read and preprocess the pharmacy data; errors propagate so failures are never cached"""
+    df = read_raw_data(file_path_or_buffer)
+    
+    # Convert Date to datetime
+    if df.schema['Date'] == pl.String:
+        try:
+            df = df.with_columns(pl.col('Date').str.to_datetime())
+        except (pl.exceptions.InvalidOperationError, pl.exceptions.ComputeError):
+            # Formats Polars can't infer (e.g. US-style 11/19/2024 02:23) go through pandas' parser
+            df = df.with_columns(pl.from_pandas(pd.to_datetime(df['Date'].to_pandas())))
+    else:
+        df = df.with_columns(pl.col('Date').cast(pl.Datetime))
+    
+    # Create the month filter column and revenue metric
+    df = df.with_columns(
+        pl.col('Date').dt.truncate('1mo').alias('Month'),
+        pl.col('TotalPrice').alias('Revenue'),
+    )
+    
+    df = df.to_pandas()
+    
+    # Repeated text keys as categoricals
+    for col in ['ServiceType', 'MedicationCategory', 'InsuranceUsed', 'PatientID']:
+        df[col] = df[col].astype('category')
+    
+    # Create service type categories
+    df['Is_Prescription'] = category_flag(df['ServiceType'], ['Prescription', 'Vaccination', 'Consultation', 'Medication Review'])
+    df['Is_Clinical_Service'] = category_flag(df['ServiceType'], ['Vaccination', 'Consultation', 'Medication Review'])
+    
+    # Create chronic medication and seasonal condition flags
+    chronic_conditions = ['Cardiovascular', 'Diabetes', 'Mental Health']
+    df['Is_Chronic'] = category_flag(df['MedicationCategory'], chronic_conditions) & category_flag(df['ServiceType'], ['Prescription'])
+    df['Is_Seasonal'] = category_flag(df['MedicationCategory'], ['Cold & Flu', 'Allergy', 'Vaccination'])
+    
+    # Rows with a recorded insurance status
+    df['Has_Insurance_Info'] = category_flag(df['InsuranceUsed'], ['Yes', 'No'])
+    
+    # Transaction class for the prescription vs OTC split
+    txn_codes = np.where(df['Is_Prescription'], 0, np.where(category_flag(df['ServiceType'], ['OTC']), 1, 2))
+    df['TxnClass'] = pd.Categorical.from_codes(txn_codes, categories=['Rx', 'OTC', 'Other'])
+    
+    return df
+
+@st.cache_data(persist="disk", max_entries=8, show_spinner="Loading pharmacy data…")
+def prepare_sample_data(_file_path, data_id):
+    """Preprocessed sample data, persisted to disk so it survives server restarts"""
+    # _file_path is not hashed; data_id carries the file's path and mtime
+    return prepare_data(_file_path)
+
+@st.cache_data(max_entries=8, show_spinner="Loading pharmacy data…")
+def prepare_uploaded_data(_buffer, data_id):
+    """Preprocessed uploaded data"""
+    # _buffer is not hashed; data_id carries the upload's name and content hash
+    return prepare_data(_buffer)
+
+def load_data(file_path_or_buffer, data_id):
     """Load and preprocess the pharmacy data"""
     try:
-        # Handle both file paths and uploaded files
         if isinstance(file_path_or_buffer, str):
-            if file_path_or_buffer.endswith('.xlsx'):
-                df = pd.read_excel(file_path_or_buffer)
-            else:
-                df = pd.read_csv(file_path_or_buffer)
-        else:
-            if file_path_or_buffer.name.endswith('.xlsx'):
-                df = pd.read_excel(file_path_or_buffer)
-            else:
-                df = pd.read_csv(file_path_or_buffer)
-        
-        # Convert Date to datetime
-        df['Date'] = pd.to_datetime(df['Date'])
-        
-        # Create additional date columns for easier filtering
-        df['Month'] = df['Date'].dt.to_period('M')
-        df['Year'] = df['Date'].dt.year
-        df['Day_of_Week'] = df['Date'].dt.day_name()
-        df['Month_Name'] = df['Date'].dt.strftime('%B %Y')
-        df['Quarter'] = df['Date'].dt.to_period('Q')
-        
-        # Calculate pharmacy-specific metrics
-        df['Revenue'] = df['TotalPrice']
-        
-        # Create service type categories
-        df['Is_Prescription'] = df['ServiceType'].isin(['Prescription', 'Vaccination', 'Consultation', 'Medication Review'])
-        df['Is_Clinical_Service'] = df['ServiceType'].isin(['Vaccination', 'Consultation', 'Medication Review'])
-        
-        # Create chronic medication flag
-        chronic_conditions = ['Cardiovascular', 'Diabetes', 'Mental Health']
-        df['Is_Chronic'] = df['MedicationCategory'].isin(chronic_conditions) & (df['ServiceType'] == 'Prescription')
-        
-        return df
+            return prepare_sample_data(file_path_or_buffer, data_id)
+        return prepare_uploaded_data(file_path_or_buffer, data_id)
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
         st.info("Please ensure your file has the required columns: TransactionID, Date, PatientID, ServiceType, MedicationCategory, Quantity, UnitPrice, InsuranceUsed, TotalPrice")
         return None
 
+@st.cache_data(max_entries=8, show_spinner=False)
+def month_index(_df, df_id):
+    """Sorted months and overall date range of the dataset"""
+    # _df is not hashed; the cache is keyed on the data source id
+    months = sorted(_df['Month'].unique())
+    return months, _df['Date'].min(), _df['Date'].max()
+
 def check_data_availability(df):
     """Check if we have sufficient data for each analysis type"""
-    availability = {}
-    
-    # Check for compliance data
-    chronic_conditions = ['Cardiovascular', 'Diabetes', 'Mental Health']
-    chronic_df = df[df['MedicationCategory'].isin(chronic_conditions) & (df['ServiceType'] == 'Prescription')]
-    availability['compliance'] = len(chronic_df) > 0
-    
-    # Check for seasonal data
-    seasonal_categories = ['Cold & Flu', 'Allergy', 'Vaccination']
-    seasonal_df = df[df['MedicationCategory'].isin(seasonal_categories)]
-    availability['seasonal'] = len(seasonal_df) > 0
-    
-    # Check for clinical services data
-    clinical_df = df[df['ServiceType'].isin(['Vaccination', 'Consultation', 'Medication Review'])]
-    availability['clinical'] = len(clinical_df) > 0
-    
-    return availability
+    return {
+        'compliance': bool(df['Is_Chronic'].to_numpy().any()),
+        'seasonal': bool(df['Is_Seasonal'].to_numpy().any()),
+        'clinical': bool(df['Is_Clinical_Service'].to_numpy().any()),
+        'insurance': bool(df['Has_Insurance_Info'].to_numpy().any())
+    }
 
 def analyze_prescription_otc_mix(df):
     """Analyze prescription vs OTC sales mix"""
-    prescription_revenue = df[df['Is_Prescription']]['TotalPrice'].sum()
-    otc_revenue = df[df['ServiceType'] == 'OTC']['TotalPrice'].sum()
+    class_revenue = df.groupby('TxnClass', observed=False, sort=False)['TotalPrice'].sum()
+    prescription_revenue = class_revenue['Rx']
+    otc_revenue = class_revenue['OTC']
     total_revenue = prescription_revenue + otc_revenue
     
     if total_revenue > 0:
@@ -230,163 +329,204 @@ def analyze_prescription_otc_mix(df):
         'otc_pct': otc_pct
     }
 
-def create_prescription_otc_chart(df):
+@st.cache_data(max_entries=8, show_spinner=False)
+def create_prescription_otc_chart(_aggregates, filter_key):
     """Create prescription vs OTC revenue visualization"""
-    analysis = analyze_prescription_otc_mix(df)
-    
-    col1, col2 = st.columns(2)
+    # _aggregates is not hashed; the cache is keyed on the data source and sidebar filters
+    analysis = _aggregates['prescription_otc']
+    
+    # Pie chart for Rx vs OTC
+    fig_pie = go.Figure(go.Pie(
+        values=[analysis['prescription_pct'], analysis['otc_pct']],
+        labels=['Prescription Services', 'OTC Products'],
+        marker=dict(colors=['#d4650f', '#f97316'])
+    ))
+    fig_pie.update_traces(
+        textposition="auto",
+        textinfo="percent+label",
+        textfont_size=12,
+        hovertemplate='<b>%{label}</b><br>Revenue: %{percent}<br>Amount: $%{value:,.2f}<extra></extra>'
+    )
+    fig_pie.update_layout(
+        title_text="Revenue Split: Prescription vs OTC",
+        title_font_size=13,
+        title_x=0.5,
+        title_y=0.95,
+        title_font_color='#d4650f',
+        height=350,
+        margin=dict(t=60, b=20, l=20, r=20),
+        font_size=10
+    )
     
-    with col1:
-        # Pie chart for Rx vs OTC
-        fig_pie = px.pie(
-            values=[analysis['prescription_pct'], analysis['otc_pct']],
-            names=['Prescription Services', 'OTC Products'],
-            title="Revenue Split: Prescription vs OTC",
-            color_discrete_sequence=['#d4650f', '#f97316']
-        )
-        fig_pie.update_traces(
-            textposition="auto",
-            textinfo="percent+label",
-            textfont_size=12,
-            hovertemplate='<b>%{label}</b><br>Revenue: %{percent}<br>Amount: $%{value:,.2f}<extra></extra>'
-        )
-        fig_pie.update_layout(
-            title_font_size=13,
-            title_x=0.5,
-            title_y=0.95,
-            title_font_color='#d4650f',
-            height=350,
-            margin=dict(t=60, b=20, l=20, r=20),
-            font_size=10
-        )
-        st.plotly_chart(fig_pie, use_container_width=True)
+    # Service type breakdown
+    service_revenue = _aggregates['service_revenue']
+    
+    revenue = service_revenue['TotalPrice'].to_numpy()
+    fig_service = go.Figure(go.Bar(
+        x=revenue,
+        y=service_revenue['ServiceType'].to_numpy(),
+        orientation='h',
+        marker=dict(color=revenue, colorscale=['#fed7aa', '#d4650f'], showscale=True, colorbar_title_text='TotalPrice')
+    ))
+    fig_service.update_traces(
+        hovertemplate='<b>%{y}</b><br>Revenue: $%{x:,.2f}<extra></extra>',
+        texttemplate='$%{x:,.0f}',
+        textposition='outside'
+    )
+    fig_service.update_layout(
+        title_text="Revenue by Service Type",
+        xaxis_title_text='TotalPrice',
+        yaxis_title_text='ServiceType',
+        title_font_size=13,
+        title_x=0.5,
+        title_y=0.95,
+        title_font_color='#d4650f',
+        height=350,
+        margin=dict(t=60, b=50, l=140, r=70),
+        showlegend=False,
+        font_size=10
+    )
     
-    with col2:
-        # Service type breakdown
-        service_revenue = df.groupby('ServiceType')['TotalPrice'].sum().reset_index()
-        service_revenue = service_revenue.sort_values('TotalPrice', ascending=True)
-        
-        fig_service = px.bar(
-            service_revenue,
-            x='TotalPrice',
-            y='ServiceType',
-            orientation='h',
-            title="Revenue by Service Type",
-            color='TotalPrice',
-            color_continuous_scale=['#fed7aa', '#d4650f']
-        )
-        fig_service.update_traces(
-            hovertemplate='<b>%{y}</b><br>Revenue: $%{x:,.2f}<extra></extra>',
-            texttemplate='$%{x:,.0f}',
-            textposition='outside'
-        )
-        fig_service.update_layout(
-            title_font_size=13,
-            title_x=0.5,
-            title_y=0.95,
-            title_font_color='#d4650f',
-            height=350,
-            margin=dict(t=60, b=50, l=140, r=70),
-            showlegend=False,
-            font_size=10
-        )
-        st.plotly_chart(fig_service, use_container_width=True)
+    return fig_pie, fig_service
 
-def create_top_medications_chart(df):
+@st.cache_data(max_entries=8, show_spinner=False)
+def create_top_medications_chart(_aggregates, filter_key):
     """Create top medications and categories visualization"""
-    category_analysis = df.groupby('MedicationCategory').agg({
-        'TotalPrice': 'sum',
-        'Quantity': 'sum',
-        'TransactionID': 'count'
-    }).reset_index()
-    category_analysis = category_analysis.sort_values('TotalPrice', ascending=False)
-    
-    col1, col2 = st.columns(2)
+    # _aggregates is not hashed; the cache is keyed on the data source and sidebar filters
+    category_analysis = _aggregates['category_analysis']
+    
+    # Top categories by revenue
+    top_10_revenue = category_analysis.head(10)
+    revenue = top_10_revenue['TotalPrice'].to_numpy()
+    fig_revenue = go.Figure(go.Bar(
+        x=revenue,
+        y=top_10_revenue['MedicationCategory'].to_numpy(),
+        orientation='h',
+        marker=dict(color=revenue, colorscale=['#fed7aa', '#d4650f'], showscale=True, colorbar_title_text='TotalPrice'),
+        text=revenue,
+        customdata=top_10_revenue['TransactionID'].to_numpy()
+    ))
+    fig_revenue.update_traces(
+        texttemplate='$%{text:,.0f}',
+        textposition='outside',
+        hovertemplate='<b>%{y}</b><br>Revenue: $%{x:,.2f}<br>Transactions: %{customdata}<extra></extra>'
+    )
+    fig_revenue.update_layout(
+        title_text="Top Categories by Revenue",
+        xaxis_title_text='TotalPrice',
+        yaxis_title_text='MedicationCategory',
+        title_font_size=13,
+        title_x=0.5,
+        title_y=0.95,
+        title_font_color='#d4650f',
+        height=400,
+        margin=dict(t=70, b=50, l=170, r=80),
+        showlegend=False,
+        font_size=10
+    )
     
-    with col1:
-        # Top categories by revenue
-        top_10_revenue = category_analysis.head(10)
-        fig_revenue = px.bar(
-            top_10_revenue,
-            x='TotalPrice',
-            y='MedicationCategory',
-            orientation='h',
-            title="Top Categories by Revenue",
-            color='TotalPrice',
-            color_continuous_scale=['#fed7aa', '#d4650f'],
-            text='TotalPrice'
-        )
-        fig_revenue.update_traces(
-            texttemplate='$%{text:,.0f}',
-            textposition='outside',
-            hovertemplate='<b>%{y}</b><br>Revenue: $%{x:,.2f}<br>Transactions: %{customdata}<extra></extra>',
-            customdata=top_10_revenue['TransactionID']
-        )
-        fig_revenue.update_layout(
-            title_font_size=13,
-            title_x=0.5,
-            title_y=0.95,
-            title_font_color='#d4650f',
-            height=400,
-            margin=dict(t=70, b=50, l=170, r=80),
-            showlegend=False,
-            font_size=10
-        )
-        st.plotly_chart(fig_revenue, use_container_width=True)
+    # Top categories by volume
+    top_10_volume = category_analysis.sort_values('Quantity', ascending=False).head(10)
+    volume = top_10_volume['Quantity'].to_numpy()
+    fig_volume = go.Figure(go.Bar(
+        x=volume,
+        y=top_10_volume['MedicationCategory'].to_numpy(),
+        orientation='h',
+        marker=dict(color=volume, colorscale=['#fef3c7', '#f59e0b'], showscale=True, colorbar_title_text='Quantity'),
+        text=volume,
+        customdata=top_10_volume['TotalPrice'].to_numpy()
+    ))
+    fig_volume.update_traces(
+        texttemplate='%{text:,}',
+        textposition='outside',
+        hovertemplate='<b>%{y}</b><br>Quantity: %{x:,}<br>Revenue: $%{customdata:,.2f}<extra></extra>'
+    )
+    fig_volume.update_layout(
+        title_text="Top Categories by Volume",
+        xaxis_title_text='Quantity',
+        yaxis_title_text='MedicationCategory',
+        title_font_size=13,
+        title_x=0.5,
+        title_y=0.95,
+        title_font_color='#f59e0b',
+        height=400,
+        margin=dict(t=70, b=50, l=170, r=80),
+        showlegend=False,
+        font_size=10
+    )
     
-    with col2:
-        # Top categories by volume
-        top_10_volume = category_analysis.sort_values('Quantity', ascending=False).head(10)
-        fig_volume = px.bar(
-            top_10_volume,
-            x='Quantity',
-            y='MedicationCategory',
-            orientation='h',
-            title="Top Categories by Volume",
-            color='Quantity',
-            color_continuous_scale=['#fef3c7', '#f59e0b'],
-            text='Quantity'
-        )
-        fig_volume.update_traces(
-            texttemplate='%{text:,}',
-            textposition='outside',
-            hovertemplate='<b>%{y}</b><br>Quantity: %{x:,}<br>Revenue: $%{customdata:,.2f}<extra></extra>',
-            customdata=top_10_volume['TotalPrice']
-        )
-        fig_volume.update_layout(
-            title_font_size=13,
-            title_x=0.5,
-            title_y=0.95,
-            title_font_color='#f59e0b',
-            height=400,
-            margin=dict(t=70, b=50, l=170, r=80),
-            showlegend=False,
-            font_size=10
-        )
-        st.plotly_chart(fig_volume, use_container_width=True)
+    return fig_revenue, fig_volume
+
+@njit(fastmath=True, cache=True)
+def _compliance_kernel(starts, dates, quantities, out_count, out_min, out_max, out_quantity_sum):
+    """Count, first/last date and quantity sum for each contiguous group of rows"""
+    for g in range(len(starts) - 1):
+        lo = starts[g]
+        hi = starts[g + 1]
+        first = dates[lo]
+        last = dates[lo]
+        quantity_sum = 0.0
+        for i in range(lo, hi):
+            if dates[i] < first:
+                first = dates[i]
+            if dates[i] > last:
+                last = dates[i]
+            quantity_sum += quantities[i]
+        out_count[g] = hi - lo
+        out_min[g] = first
+        out_max[g] = last
+        out_quantity_sum[g] = quantity_sum
 
 def analyze_patient_compliance(df):
     """Analyze patient refill compliance for chronic medications"""
-    chronic_conditions = ['Cardiovascular', 'Diabetes', 'Mental Health']
-    chronic_df = df[df['Is_Chronic']]
+    # Rows without a PatientID (code -1) can't be grouped by patient, as in a groupby
+    chronic_df = df[df['Is_Chronic'].to_numpy() & (df['PatientID'].cat.codes.to_numpy() >= 0)]
     
     if chronic_df.empty:
         return None, None
     
-    # Calculate refill patterns by patient
-    patient_refills = chronic_df.groupby(['PatientID', 'MedicationCategory']).agg({
-        'Date': ['count', 'min', 'max'],
-        'Quantity': 'mean'
-    }).reset_index()
-    
-    patient_refills.columns = ['PatientID', 'Category', 'Refill_Count', 'First_Fill', 'Last_Fill', 'Avg_Days_Supply']
+    # Encode (patient, category) into one integer key and sort so each group is a contiguous run
+    patient_codes = chronic_df['PatientID'].cat.codes.to_numpy()
+    patients = chronic_df['PatientID'].cat.categories
+    categories = chronic_df['MedicationCategory'].cat
+    keys = patient_codes.astype(np.int64) * len(categories.categories) + categories.codes.to_numpy()
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    dates = chronic_df['Date'].to_numpy()[order]
+    quantities = chronic_df['Quantity'].to_numpy(dtype=np.float64)[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1, [len(keys)]))
+    
+    # Calculate refill patterns by patient in a single pass
+    n_groups = len(starts) - 1
+    refill_count = np.empty(n_groups, dtype=np.int64)
+    first_fill = np.empty(n_groups, dtype=np.int64)
+    last_fill = np.empty(n_groups, dtype=np.int64)
+    quantity_sum = np.empty(n_groups, dtype=np.float64)
+    _compliance_kernel(starts, dates.view(np.int64), quantities, refill_count, first_fill, last_fill, quantity_sum)
+    
+    group_keys = keys[starts[:-1]]
+    first_fill = first_fill.view(dates.dtype)
+    last_fill = last_fill.view(dates.dtype)
+    avg_days_supply = quantity_sum / refill_count
     
     # Calculate days between first and last fill
-    patient_refills['Days_Between'] = (patient_refills['Last_Fill'] - patient_refills['First_Fill']).dt.days
+    days_between = (last_fill - first_fill) // np.timedelta64(1, 'D')
     
     # Estimate compliance (simplified calculation)
-    patient_refills['Expected_Refills'] = np.maximum(1, patient_refills['Days_Between'] / patient_refills['Avg_Days_Supply'])
-    patient_refills['Compliance_Rate'] = np.minimum(100, (patient_refills['Refill_Count'] / patient_refills['Expected_Refills'] * 100))
+    expected_refills = np.fmax(1, days_between / avg_days_supply)
+    compliance_rate = np.fmin(100, refill_count / expected_refills * 100)
+    
+    patient_refills = pd.DataFrame({
+        'PatientID': patients[group_keys // len(categories.categories)],
+        'Category': pd.Categorical.from_codes(group_keys % len(categories.categories), categories.categories),
+        'Refill_Count': refill_count,
+        'First_Fill': first_fill,
+        'Last_Fill': last_fill,
+        'Avg_Days_Supply': avg_days_supply,
+        'Days_Between': days_between,
+        'Expected_Refills': expected_refills,
+        'Compliance_Rate': compliance_rate
+    })
     
     # Calculate summary metrics
     avg_compliance = patient_refills['Compliance_Rate'].mean()
@@ -399,250 +539,347 @@ def analyze_patient_compliance(df):
         'total_chronic_patients': total_chronic_patients
     }
 
-def create_compliance_charts(df):
+@st.cache_data(max_entries=8, show_spinner=False)
+def create_compliance_charts(_aggregates, filter_key):
     """Create patient compliance visualization"""
-    compliance_data, summary = analyze_patient_compliance(df)
+    # _aggregates is not hashed; the cache is keyed on the data source and sidebar filters
+    compliance_data = _aggregates['compliance_data']
     
     if compliance_data is None:
-        return False
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        # Compliance rate distribution
-        fig_compliance = px.histogram(
-            compliance_data,
-            x='Compliance_Rate',
-            nbins=15,
-            title="Patient Compliance Rate Distribution",
-            color_discrete_sequence=['#d4650f'],
-            labels={'Compliance_Rate': 'Compliance Rate (%)', 'count': 'Number of Patients'}
-        )
-        fig_compliance.update_traces(
-            hovertemplate='Compliance Rate: %{x}%<br>Patients: %{y}<extra></extra>'
-        )
-        fig_compliance.update_layout(
-            title_font_size=13,
-            title_x=0.5,
-            title_y=0.95,
-            title_font_color='#d4650f',
-            height=350,
-            margin=dict(t=70, b=50, l=50, r=50),
-            font_size=10
-        )
-        st.plotly_chart(fig_compliance, use_container_width=True)
+        return None
     
-    with col2:
-        # Compliance by category
-        avg_compliance_by_category = compliance_data.groupby('Category')['Compliance_Rate'].mean().reset_index()
-        fig_category = px.bar(
-            avg_compliance_by_category,
-            x='Category',
-            y='Compliance_Rate',
-            title="Average Compliance by Condition",
-            color='Compliance_Rate',
-            color_continuous_scale=['#fef3c7', '#d4650f']
-        )
-        fig_category.update_traces(
-            texttemplate='%{y:.1f}%',
-            textposition='outside',
-            hovertemplate='<b>%{x}</b><br>Avg Compliance: %{y:.1f}%<extra></extra>'
-        )
-        fig_category.update_layout(
-            title_font_size=13,
-            title_x=0.5,
-            title_y=0.95,
-            title_font_color='#d4650f',
-            height=350,
-            margin=dict(t=70, b=50, l=50, r=50),
-            showlegend=False,
-            font_size=10
-        )
-        st.plotly_chart(fig_category, use_container_width=True)
+    # Compliance rate distribution
+    fig_compliance = go.Figure(go.Histogram(
+        x=compliance_data['Compliance_Rate'].to_numpy(),
+        nbinsx=15,
+        marker_color='#d4650f'
+    ))
+    fig_compliance.update_traces(
+        hovertemplate='Compliance Rate: %{x}%<br>Patients: %{y}<extra></extra>'
+    )
+    fig_compliance.update_layout(
+        title_text="Patient Compliance Rate Distribution",
+        xaxis_title_text='Compliance Rate (%)',
+        yaxis_title_text='count',
+        title_font_size=13,
+        title_x=0.5,
+        title_y=0.95,
+        title_font_color='#d4650f',
+        height=350,
+        margin=dict(t=70, b=50, l=50, r=50),
+        font_size=10
+    )
     
-    # Summary metrics only
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric("Average Compliance Rate", f"{summary['avg_compliance']:.1f}%")
-    with col2:
-        st.metric("High Adherence Patients", f"{summary['high_compliance_count']}")
-    with col3:
-        st.metric("Total Chronic Patients", f"{summary['total_chronic_patients']}")
+    # Compliance by category
+    avg_compliance_by_category = _aggregates['compliance_by_category']
+    compliance_rate = avg_compliance_by_category['Compliance_Rate'].to_numpy()
+    fig_category = go.Figure(go.Bar(
+        x=avg_compliance_by_category['Category'].to_numpy(),
+        y=compliance_rate,
+        marker=dict(color=compliance_rate, colorscale=['#fef3c7', '#d4650f'], showscale=True, colorbar_title_text='Compliance_Rate')
+    ))
+    fig_category.update_traces(
+        texttemplate='%{y:.1f}%',
+        textposition='outside',
+        hovertemplate='<b>%{x}</b><br>Avg Compliance: %{y:.1f}%<extra></extra>'
+    )
+    fig_category.update_layout(
+        title_text="Average Compliance by Condition",
+        xaxis_title_text='Category',
+        yaxis_title_text='Compliance_Rate',
+        title_font_size=13,
+        title_x=0.5,
+        title_y=0.95,
+        title_font_color='#d4650f',
+        height=350,
+        margin=dict(t=70, b=50, l=50, r=50),
+        showlegend=False,
+        font_size=10
+    )
     
-    return True
+    return fig_compliance, fig_category
 
-def create_insurance_analysis(df):
+@st.cache_data(max_entries=8, show_spinner=False)
+def create_insurance_analysis(_aggregates, filter_key):
     """Create insurance vs cash pay analysis"""
-    insurance_breakdown = df.groupby('InsuranceUsed').agg({
-        'TotalPrice': 'sum',
-        'TransactionID': 'count'
-    }).reset_index()
+    # _aggregates is not hashed; the cache is keyed on the data source and sidebar filters
+    insurance_breakdown = _aggregates['insurance_breakdown']
+    
+    # Insurance vs cash pie chart
+    fig_insurance = go.Figure(go.Pie(
+        values=insurance_breakdown['TotalPrice'].to_numpy(),
+        labels=insurance_breakdown['InsuranceUsed'].to_numpy(),
+        marker=dict(colors=['#f59e0b', '#d4650f'])
+    ))
+    fig_insurance.update_traces(
+        textposition="auto",
+        textinfo="percent+label",
+        textfont_size=12,
+        hovertemplate='<b>%{label}</b><br>Revenue: $%{value:,.2f}<br>Percentage: %{percent}<extra></extra>'
+    )
+    fig_insurance.update_layout(
+        title_text="Revenue: Insurance vs Cash Pay",
+        title_font_size=14,
+        title_x=0.5,
+        title_font_color='#d4650f',
+        height=350
+    )
     
-    col1, col2 = st.columns(2)
+    # Insurance usage by service type
+    service_insurance = _aggregates['service_insurance']
     
-    with col1:
-        # Insurance vs cash pie chart
-        fig_insurance = px.pie(
-            insurance_breakdown,
-            values='TotalPrice',
-            names='InsuranceUsed',
-            title="Revenue: Insurance vs Cash Pay",
-            color_discrete_sequence=['#f59e0b', '#d4650f']
-        )
-        fig_insurance.update_traces(
-            textposition="auto",
-            textinfo="percent+label",
-            textfont_size=12,
-            hovertemplate='<b>%{label}</b><br>Revenue: $%{value:,.2f}<br>Percentage: %{percent}<extra></extra>'
-        )
-        fig_insurance.update_layout(
-            title_font_size=14,
-            title_x=0.5,
-            title_font_color='#d4650f',
-            height=350
+    insurance_colors = {'Yes': '#d4650f', 'No': '#f59e0b'}
+    fig_service_insurance = go.Figure([
+        go.Bar(
+            x=group['ServiceType'].to_numpy(),
+            y=group['TotalPrice'].to_numpy(),
+            name=str(insurance),
+            marker_color=insurance_colors.get(insurance)
         )
-        st.plotly_chart(fig_insurance, use_container_width=True)
+        for insurance, group in service_insurance.groupby('InsuranceUsed', observed=True, sort=False)
+    ])
+    fig_service_insurance.update_traces(
+        hovertemplate='<b>%{x}</b><br>Revenue: $%{y:,.2f}<extra></extra>'
+    )
+    fig_service_insurance.update_layout(
+        title_text="Insurance Usage by Service Type",
+        xaxis_title_text='ServiceType',
+        yaxis_title_text='TotalPrice',
+        legend_title_text='InsuranceUsed',
+        barmode='group',
+        title_font_size=14,
+        title_x=0.5,
+        title_font_color='#d4650f',
+        height=350,
+        margin=dict(t=50, b=50, l=50, r=50),
+        xaxis_tickangle=-45
+    )
     
-    with col2:
-        # Insurance usage by service type
-        service_insurance = df.groupby(['ServiceType', 'InsuranceUsed']).agg({
-            'TotalPrice': 'sum'
-        }).reset_index()
-        
-        fig_service_insurance = px.bar(
-            service_insurance,
-            x='ServiceType',
-            y='TotalPrice',
-            color='InsuranceUsed',
-            title="Insurance Usage by Service Type",
-            color_discrete_map={'Yes': '#d4650f', 'No': '#f59e0b'},
-            barmode='group'
-        )
-        fig_service_insurance.update_traces(
-            hovertemplate='<b>%{x}</b><br>Revenue: $%{y:,.2f}<extra></extra>'
-        )
-        fig_service_insurance.update_layout(
-            title_font_size=14,
-            title_x=0.5,
-            title_font_color='#d4650f',
-            height=350,
-            margin=dict(t=50, b=50, l=50, r=50),
-            xaxis_tickangle=-45
-        )
-        st.plotly_chart(fig_service_insurance, use_container_width=True)
+    return fig_insurance, fig_service_insurance
 
-def create_seasonality_analysis(df):
+@st.cache_data(max_entries=8, show_spinner=False)
+def create_seasonality_analysis(_aggregates, filter_key):
     """Create seasonality analysis for health conditions"""
-    seasonal_categories = ['Cold & Flu', 'Allergy', 'Vaccination']
-    seasonal_df = df[df['MedicationCategory'].isin(seasonal_categories)]
+    # _aggregates is not hashed; the cache is keyed on the data source and sidebar filters
+    monthly_trends = _aggregates['monthly_trends']
     
-    if seasonal_df.empty:
-        return False
-    
-    monthly_trends = seasonal_df.groupby([seasonal_df['Date'].dt.month, 'MedicationCategory']).agg({
-        'TotalPrice': 'sum',
-        'TransactionID': 'count'
-    }).reset_index()
-    monthly_trends['Month'] = monthly_trends['Date'].apply(lambda x: calendar.month_name[x])
+    if monthly_trends is None:
+        return None
     
     # Seasonal trends chart
-    fig_seasonal = px.line(
-        monthly_trends,
-        x='Month',
-        y='TotalPrice',
-        color='MedicationCategory',
-        title="Seasonal Health Condition Revenue Trends",
-        markers=True,
-        color_discrete_sequence=['#d4650f', '#f97316', '#fb923c']
-    )
+    line_colors = ['#d4650f', '#f97316', '#fb923c']
+    fig_seasonal = go.Figure([
+        go.Scatter(
+            x=months,
+            y=revenue,
+            name=str(category),
+            mode='lines+markers',
+            line_color=line_colors[i % len(line_colors)]
+        )
+        for i, (category, (months, revenue)) in enumerate(monthly_trends.items())
+    ])
     fig_seasonal.update_traces(
         line_width=3,
         marker_size=8,
         hovertemplate='<b>%{fullData.name}</b><br>Month: %{x}<br>Revenue: $%{y:,.2f}<extra></extra>'
     )
     fig_seasonal.update_layout(
+        title_text="Seasonal Health Condition Revenue Trends",
+        xaxis_title_text='Month',
+        yaxis_title_text='TotalPrice',
+        legend_title_text='MedicationCategory',
         title_font_size=16,
         title_x=0.5,
         title_font_color='#d4650f',
         height=400,
         margin=dict(t=60, b=50, l=80, r=50)
     )
-    st.plotly_chart(fig_seasonal, use_container_width=True)
-    return True
+    
+    return fig_seasonal
 
-def create_clinical_services_analysis(df):
+@st.cache_data(max_entries=8, show_spinner=False)
+def create_clinical_services_analysis(_aggregates, filter_key):
     """Create clinical services uptake analysis"""
-    clinical_df = df[df['Is_Clinical_Service']]
+    # _aggregates is not hashed; the cache is keyed on the data source and sidebar filters
+    clinical_revenue = _aggregates['clinical_revenue']
+    clinical_volume = _aggregates['clinical_volume']
     
-    if clinical_df.empty:
-        return False
+    if clinical_revenue is None:
+        return None
     
-    col1, col2 = st.columns(2)
+    # Clinical services revenue
+    revenue = clinical_revenue['TotalPrice'].to_numpy()
+    fig_clinical_rev = go.Figure(go.Bar(
+        x=clinical_revenue['ServiceType'].to_numpy(),
+        y=revenue,
+        marker=dict(color=revenue, colorscale=['#fed7aa', '#d4650f'], showscale=True, colorbar_title_text='TotalPrice'),
+        text=revenue
+    ))
+    fig_clinical_rev.update_traces(
+        texttemplate='$%{text:,.0f}',
+        textposition='outside',
+        hovertemplate='<b>%{x}</b><br>Revenue: $%{y:,.2f}<extra></extra>'
+    )
+    fig_clinical_rev.update_layout(
+        title_text="Clinical Services Revenue",
+        xaxis_title_text='ServiceType',
+        yaxis_title_text='TotalPrice',
+        title_font_size=14,
+        title_x=0.5,
+        title_font_color='#d4650f',
+        height=350,
+        showlegend=False
+    )
     
-    with col1:
-        # Clinical services revenue
-        clinical_revenue = clinical_df.groupby('ServiceType')['TotalPrice'].sum().reset_index()
-        fig_clinical_rev = px.bar(
-            clinical_revenue,
-            x='ServiceType',
-            y='TotalPrice',
-            title="Clinical Services Revenue",
-            color='TotalPrice',
-            color_continuous_scale=['#fed7aa', '#d4650f'],
-            text='TotalPrice'
-        )
-        fig_clinical_rev.update_traces(
-            texttemplate='$%{text:,.0f}',
-            textposition='outside',
-            hovertemplate='<b>%{x}</b><br>Revenue: $%{y:,.2f}<extra></extra>'
-        )
-        fig_clinical_rev.update_layout(
-            title_font_size=14,
-            title_x=0.5,
-            title_font_color='#d4650f',
-            height=350,
-            showlegend=False
-        )
-        st.plotly_chart(fig_clinical_rev, use_container_width=True)
+    # Clinical services volume
+    fig_clinical_vol = go.Figure(go.Pie(
+        values=clinical_volume['TransactionID'].to_numpy(),
+        labels=clinical_volume['ServiceType'].to_numpy(),
+        marker=dict(colors=['#d4650f', '#f97316', '#fb923c'])
+    ))
+    fig_clinical_vol.update_traces(
+        textposition="auto",
+        textinfo="percent+label",
+        textfont_size=11,
+        hovertemplate='<b>%{label}</b><br>Appointments: %{value}<br>Percentage: %{percent}<extra></extra>'
+    )
+    fig_clinical_vol.update_layout(
+        title_text="Clinical Services Volume Distribution",
+        title_font_size=14,
+        title_x=0.5,
+        title_font_color='#d4650f',
+        height=350
+    )
     
-    with col2:
-        # Clinical services volume
-        clinical_volume = clinical_df.groupby('ServiceType')['TransactionID'].count().reset_index()
-        fig_clinical_vol = px.pie(
-            clinical_volume,
-            values='TransactionID',
-            names='ServiceType',
-            title="Clinical Services Volume Distribution",
-            color_discrete_sequence=['#d4650f', '#f97316', '#fb923c']
-        )
-        fig_clinical_vol.update_traces(
-            textposition="auto",
-            textinfo="percent+label",
-            textfont_size=11,
-            hovertemplate='<b>%{label}</b><br>Appointments: %{value}<br>Percentage: %{percent}<extra></extra>'
-        )
-        fig_clinical_vol.update_layout(
-            title_font_size=14,
-            title_x=0.5,
-            title_font_color='#d4650f',
-            height=350
-        )
-        st.plotly_chart(fig_clinical_vol, use_container_width=True)
+    return fig_clinical_rev, fig_clinical_vol
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def prescription_otc_aggregates(_df, df_id, month, date_range):
+    """Prescription/OTC split and revenue per service type"""
+    # _df is not hashed; the cache is keyed on the data source and sidebar filters
+    service_revenue = _df.groupby('ServiceType', observed=True)['TotalPrice'].sum().reset_index()
+    return {
+        'prescription_otc': analyze_prescription_otc_mix(_df),
+        'service_revenue': service_revenue.sort_values('TotalPrice', ascending=True)
+    }
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def category_aggregates(_df, df_id, month, date_range):
+    """Revenue, quantity and transactions per medication category"""
+    # _df is not hashed; the cache is keyed on the data source and sidebar filters
+    category_analysis = _df.groupby('MedicationCategory', observed=True).agg({
+        'TotalPrice': 'sum',
+        'Quantity': 'sum',
+        'TransactionID': 'count'
+    }).reset_index()
+    return {'category_analysis': category_analysis.sort_values('TotalPrice', ascending=False)}
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def compliance_aggregates(_df, df_id, month, date_range):
+    """Per-patient refill compliance, its summary and the per-category average"""
+    # _df is not hashed; the cache is keyed on the data source and sidebar filters
+    compliance_data, summary = analyze_patient_compliance(_df)
+    if compliance_data is not None:
+        compliance_by_category = compliance_data.groupby('Category', observed=True)['Compliance_Rate'].mean().reset_index()
+    else:
+        compliance_by_category = None
+    return {
+        'compliance_data': compliance_data,
+        'compliance_summary': summary,
+        'compliance_by_category': compliance_by_category
+    }
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def insurance_aggregates(_df, df_id, month, date_range):
+    """Revenue and transactions by insurance usage, overall and per service type"""
+    # _df is not hashed; the cache is keyed on the data source and sidebar filters
+    return {
+        'insurance_breakdown': _df.groupby('InsuranceUsed', observed=True).agg({
+            'TotalPrice': 'sum',
+            'TransactionID': 'count'
+        }).reset_index(),
+        'service_insurance': _df.groupby(['ServiceType', 'InsuranceUsed'], observed=True).agg({
+            'TotalPrice': 'sum'
+        }).reset_index()
+    }
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def seasonal_aggregates(_df, df_id, month, date_range):
+    """Revenue per calendar month for each seasonal category"""
+    # _df is not hashed; the cache is keyed on the data source and sidebar filters
+    seasonal = _df['Is_Seasonal'].to_numpy()
+    if not seasonal.any():
+        return {'monthly_trends': None}
+    
+    months = _df['Date'].to_numpy()[seasonal].astype('datetime64[M]').astype(np.int64) % 12 + 1
+    category_codes = _df['MedicationCategory'].cat.codes.to_numpy()[seasonal]
+    prices = _df['TotalPrice'].to_numpy()[seasonal]
+    month_names = np.array(calendar.month_name[1:])
+    monthly_trends = {}
+    for code in np.unique(category_codes):
+        in_category = category_codes == code
+        revenue_by_month = np.bincount(months[in_category], weights=prices[in_category], minlength=13)[1:]
+        has_sales = np.bincount(months[in_category], minlength=13)[1:] > 0
+        monthly_trends[_df['MedicationCategory'].cat.categories[code]] = (month_names[has_sales], revenue_by_month[has_sales])
+    return {'monthly_trends': monthly_trends}
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def clinical_aggregates(_df, df_id, month, date_range):
+    """Revenue and transaction count per clinical service"""
+    # _df is not hashed; the cache is keyed on the data source and sidebar filters
+    clinical_df = _df[_df['Is_Clinical_Service']]
+    if clinical_df.empty:
+        return {'clinical_revenue': None, 'clinical_volume': None}
+    return {
+        'clinical_revenue': clinical_df.groupby('ServiceType', observed=True)['TotalPrice'].sum().reset_index(),
+        'clinical_volume': clinical_df.groupby('ServiceType', observed=True)['TransactionID'].count().reset_index()
+    }
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def export_csv(_df, df_id, month, date_range):
+    """Serialize the filtered data to CSV bytes for download"""
+    # _df is not hashed; the cache is keyed on the data source and sidebar filters
+    # PyArrow's CSV writer serializes straight from the columnar buffers
+    table = pa.Table.from_pandas(_df.drop(columns=list(_HELPER_COLS)), preserve_index=False)
+    # Keep the pandas export's formats: whole-second timestamps, Month as YYYY-MM, True/False flags
+    for i, field in enumerate(table.schema):
+        if field.name == 'Month':
+            column = pc.strftime(table.column(i), format='%Y-%m')
+        elif pa.types.is_timestamp(field.type):
+            # %S prints fractional digits at sub-second units; source timestamps carry whole seconds
+            column = pc.strftime(pc.cast(table.column(i), pa.timestamp('s'), safe=False), format='%Y-%m-%d %H:%M:%S')
+        elif pa.types.is_boolean(field.type):
+            column = pc.if_else(table.column(i), 'True', 'False')
+        else:
+            continue
+        table = table.set_column(i, field.name, column)
     
-    return True
+    buffer = io.BytesIO()
+    pa_csv.write_csv(table, buffer)
+    return buffer.getvalue()
 
-def create_daily_sales_trend(df):
+@st.cache_data(max_entries=8, show_spinner=False)
+def create_daily_sales_trend(_df, filter_key):
     """Create daily sales trend line chart for pharmacy"""
-    daily_sales = df.groupby('Date')['Revenue'].sum().reset_index()
-    
-    fig = px.line(
-        daily_sales,
-        x='Date',
-        y='Revenue',
-        title='Daily Pharmacy Sales Trend',
-        labels={'Revenue': 'Total Revenue ($)', 'Date': 'Date'},
+    # _df is not hashed; the cache is keyed on the data source and sidebar filters
+    df = _df
+    # Sum revenue per calendar day with one bincount over day offsets, keeping only days with sales
+    days = df['Date'].to_numpy().astype('datetime64[D]')
+    if len(days) > 0:
+        first_day = days.min()
+        day_idx = (days - first_day).astype(np.int64)
+        has_sales = np.bincount(day_idx) > 0
+        daily_revenue = np.bincount(day_idx, weights=df['Revenue'].to_numpy())[has_sales]
+        sales_days = first_day + np.flatnonzero(has_sales).astype('timedelta64[D]')
+    else:
+        daily_revenue = np.array([], dtype=np.float64)
+        sales_days = np.array([], dtype='datetime64[D]')
+    
+    fig = go.Figure(go.Scatter(
+        x=sales_days,
+        y=daily_revenue,
         line_shape='spline'
-    )
+    ))
     
     fig.update_traces(
         line_color='#d4650f',
@@ -653,6 +890,9 @@ def create_daily_sales_trend(df):
     )
     
     fig.update_layout(
+        title_text='Daily Pharmacy Sales Trend',
+        xaxis_title_text='Date',
+        yaxis_title_text='Total Revenue ($)',
         title_font_size=16,
         title_x=0.5,
         title_y=0.95,
@@ -675,28 +915,226 @@ def create_pharmacy_specific_metrics(df):
     </div>
     """, unsafe_allow_html=True)
     
+    # Pull the raw arrays once and compute every KPI from them
+    prices = df['TotalPrice'].to_numpy()
+    is_prescription = category_flag(df['ServiceType'], ['Prescription'])
+    is_insured = category_flag(df['InsuranceUsed'], ['Yes'])
+    is_clinical = df['Is_Clinical_Service'].to_numpy()
+    chronic_patient_codes = df['PatientID'].cat.codes.to_numpy()[df['Is_Chronic'].to_numpy()]
+    
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         # Average prescription value
-        rx_avg = df[df['ServiceType'] == 'Prescription']['TotalPrice'].mean() if len(df[df['ServiceType'] == 'Prescription']) > 0 else 0
+        rx_avg = prices[is_prescription].mean() if is_prescription.any() else 0
         st.metric("Avg Prescription Value", f"${rx_avg:.2f}")
     
     with col2:
         # Clinical services uptake rate
-        clinical_pct = (len(df[df['Is_Clinical_Service']]) / len(df)) * 100 if len(df) > 0 else 0
+        clinical_pct = is_clinical.mean() * 100 if len(df) > 0 else 0
         st.metric("Clinical Services Rate", f"{clinical_pct:.1f}%")
     
     with col3:
         # Insurance utilization rate
-        insurance_pct = (len(df[df['InsuranceUsed'] == 'Yes']) / len(df)) * 100 if len(df) > 0 else 0
+        insurance_pct = is_insured.mean() * 100 if len(df) > 0 else 0
         st.metric("Insurance Utilization", f"{insurance_pct:.1f}%")
     
     with col4:
         # Chronic medication patients
-        chronic_patients = df[df['Is_Chronic']]['PatientID'].nunique()
+        chronic_patients = np.unique(chronic_patient_codes[chronic_patient_codes >= 0]).size
         st.metric("Chronic Care Patients", f"{chronic_patients:,}")
 
+def render_revenue_analysis(filtered_df, data_availability, filter_key):
+    """Render the Revenue Analysis tab"""
+    st.header("Sales Trend Analysis")
+    st.plotly_chart(create_daily_sales_trend(filtered_df, filter_key), width="stretch")
+
+def render_prescription_otc(filtered_df, data_availability, filter_key):
+    """Render the Prescription vs OTC tab"""
+    st.header("Prescription vs OTC Sales Analysis")
+    aggregates = prescription_otc_aggregates(filtered_df, *filter_key)
+    fig_pie, fig_service = create_prescription_otc_chart(aggregates, filter_key)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(fig_pie, width="stretch")
+    with col2:
+        st.plotly_chart(fig_service, width="stretch")
+
+def render_top_categories(filtered_df, data_availability, filter_key):
+    """Render the Top Categories tab"""
+    st.header("Top Medications and Categories")
+    aggregates = category_aggregates(filtered_df, *filter_key)
+    fig_revenue, fig_volume = create_top_medications_chart(aggregates, filter_key)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(fig_revenue, width="stretch")
+    with col2:
+        st.plotly_chart(fig_volume, width="stretch")
+    
+    # Detailed category performance table
+    st.subheader("Category Performance Details")
+    # Per-category sums and counts with bincount over the category codes
+    category_codes = filtered_df['MedicationCategory'].cat.codes.to_numpy()
+    categories = filtered_df['MedicationCategory'].cat.categories
+    in_category = category_codes >= 0
+    category_codes = category_codes[in_category]
+    n_categories = len(categories)
+    transactions = np.bincount(category_codes, minlength=n_categories)
+    total_revenue = np.bincount(category_codes, weights=filtered_df['TotalPrice'].to_numpy()[in_category], minlength=n_categories)
+    total_quantity = np.bincount(category_codes, weights=filtered_df['Quantity'].to_numpy()[in_category], minlength=n_categories)
+    
+    # Distinct patients per category from the unique (category, patient) code pairs
+    patient_codes = filtered_df['PatientID'].cat.codes.to_numpy()[in_category]
+    n_patients = len(filtered_df['PatientID'].cat.categories)
+    has_patient = patient_codes >= 0
+    pairs = np.unique(category_codes[has_patient].astype(np.int64) * n_patients + patient_codes[has_patient])
+    unique_patients = np.bincount(pairs // n_patients, minlength=n_categories)
+    
+    observed = transactions > 0
+    category_details = pd.DataFrame({
+        'Total Revenue': total_revenue[observed],
+        'Avg Revenue': total_revenue[observed] / transactions[observed],
+        'Total Quantity': total_quantity[observed].astype(np.int64),
+        'Transactions': transactions[observed],
+        'Unique Patients': unique_patients[observed]
+    }, index=pd.Index(categories[observed], name='MedicationCategory'))
+    category_details = category_details.sort_values('Total Revenue', ascending=False)
+    
+    st.dataframe(
+        category_details.style.format({
+            'Total Revenue': '${:,.2f}',
+            'Avg Revenue': '${:.2f}',
+            'Total Quantity': '{:,}',
+            'Transactions': '{:,}',
+            'Unique Patients': '{:,}'
+        }),
+        width="stretch"
+    )
+
+def render_patient_compliance(filtered_df, data_availability, filter_key):
+    """Render the Patient Compliance tab"""
+    st.header("Patient Refill Compliance Analysis")
+    aggregates = compliance_aggregates(filtered_df, *filter_key)
+    figures = create_compliance_charts(aggregates, filter_key)
+    if figures is None:
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(figures[0], width="stretch")
+    with col2:
+        st.plotly_chart(figures[1], width="stretch")
+    
+    # Summary metrics only
+    summary = aggregates['compliance_summary']
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Average Compliance Rate", f"{summary['avg_compliance']:.1f}%")
+    with col2:
+        st.metric("High Adherence Patients", f"{summary['high_compliance_count']}")
+    with col3:
+        st.metric("Total Chronic Patients", f"{summary['total_chronic_patients']}")
+
+def render_business_patterns(filtered_df, data_availability, filter_key):
+    """Render the Business Patterns tab"""
+    st.header("Business Patterns Analysis")
+    
+    # Insurance Analysis Section
+    if data_availability['insurance']:
+        st.subheader("Insurance vs Cash Pay Trends")
+        aggregates = insurance_aggregates(filtered_df, *filter_key)
+        fig_insurance, fig_service_insurance = create_insurance_analysis(aggregates, filter_key)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.plotly_chart(fig_insurance, width="stretch")
+        with col2:
+            st.plotly_chart(fig_service_insurance, width="stretch")
+    
+    # Seasonal Analysis Section
+    if data_availability['seasonal']:
+        st.subheader("Seasonal Health Condition Patterns")
+        aggregates = seasonal_aggregates(filtered_df, *filter_key)
+        fig_seasonal = create_seasonality_analysis(aggregates, filter_key)
+        if fig_seasonal is not None:
+            st.plotly_chart(fig_seasonal, width="stretch")
+
+def render_clinical_services(filtered_df, data_availability, filter_key):
+    """Render the Clinical Services tab"""
+    st.header("Clinical Services Performance")
+    aggregates = clinical_aggregates(filtered_df, *filter_key)
+    figures = create_clinical_services_analysis(aggregates, filter_key)
+    if figures is None:
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(figures[0], width="stretch")
+    with col2:
+        st.plotly_chart(figures[1], width="stretch")
+
+# Tab name -> render function
+_TAB_RENDERERS = {
+    "Revenue Analysis": render_revenue_analysis,
+    "Prescription vs OTC": render_prescription_otc,
+    "Top Categories": render_top_categories,
+    "Patient Compliance": render_patient_compliance,
+    "Business Patterns": render_business_patterns,
+    "Clinical Services": render_clinical_services
+}
+
+@st.fragment
+def render_tabs(filtered_df, data_availability, filter_key):
+    """Render the dashboard tabs; switching tabs reruns only this fragment"""
+    # Create tabs dynamically; rerun on switch so only the open tab renders
+    tab_configs = [config for config in _TAB_CONFIGS if not config[1] or any(data_availability[flag] for flag in config[1])]
+    tab_names = [config[0] for config in tab_configs]
+    tabs = st.tabs(tab_names, key="active_tab", on_change="rerun")
+    
+    # Content for the active tab only; each renderer computes its own cached aggregates
+    for tab_name, tab in zip(tab_names, tabs):
+        if not tab.open:
+            continue
+        with tab:
+            _TAB_RENDERERS[tab_name](filtered_df, data_availability, filter_key)
+
+@st.fragment
+def render_raw_data(filtered_df, selected_month, filter_key):
+    """Render the transaction preview and CSV download"""
+    # Rerun only this fragment when toggled, and skip the work while collapsed
+    expander = st.expander("View Detailed Transaction Data", key="raw_data_expander", on_change="rerun")
+    if not expander.open:
+        return
+    with expander:
+        st.subheader("Recent Pharmacy Transactions")
+        # Partial selection of the 50 most recent rows instead of sorting everything
+        display_df = filtered_df.nlargest(50, 'Date')
+        total_count = len(filtered_df)
+        
+        # Show formatted transaction data
+        formatted_display = display_df.loc[:, list(_TXN_PREVIEW_COLS)].copy()
+        formatted_display['Date'] = formatted_display['Date'].dt.strftime('%Y-%m-%d')
+        for col in ['UnitPrice', 'TotalPrice']:
+            formatted_display[col] = '$' + formatted_display[col].map('{:.2f}'.format)
+        
+        st.dataframe(
+            pa.Table.from_pandas(formatted_display, preserve_index=False),
+            width="stretch",
+            height=400
+        )
+        
+        if total_count > 50:
+            st.info(f"Showing first 50 of {total_count:,} transactions. Download complete report below.")
+        
+        # Download button - the CSV is only built when the button is clicked
+        st.download_button(
+            label="Download Pharmacy Analytics Report (CSV)",
+            data=lambda: export_csv(filtered_df, *filter_key),
+            file_name=f"clarus_pharmacy_analytics_{selected_month:%Y-%m}.csv",
+            mime="text/csv"
+        )
+
 def main():
     """Main Clarus pharmacy dashboard function"""
     # Header
@@ -732,46 +1170,49 @@ def main():
     
     # Load data based on user choice
     if uploaded_file is not None:
-        df = load_data(uploaded_file)
+        # Content hash so every cache downstream tells edited re-uploads apart
+        data_id = f"{uploaded_file.name}:{hashlib.sha256(uploaded_file.getvalue()).hexdigest()}"
+        df = load_data(uploaded_file, data_id)
+        if df is None:
+            return
         st.sidebar.success("Your data loaded successfully!")
         st.sidebar.info(f"Analyzing {len(df):,} transactions")
     else:
-        # Try to load sample data - check for both CSV and Excel formats
-        sample_data_loaded = False
-        
-        # Try CSV first
-        try:
-            df = load_data('synthetic_pharmacy_data.csv')
-            if data_option == "View Sample Data":
-                st.sidebar.success("Sample data loaded (CSV)")
-            sample_data_loaded = True
-        except:
-            # Try Excel if CSV fails
-            try:
-                df = load_data('synthetic_pharmacy_data.xlsx')
-                if data_option == "View Sample Data":
-                    st.sidebar.success("Sample data loaded (Excel)")
-                sample_data_loaded = True
-            except:
-                pass
+        # Try to load sample data - prefer the pre-typed Parquet copy, then CSV, then Excel
+        sample_formats = {
+            SAMPLE_PARQUET_PATH: "Parquet",
+            'synthetic_pharmacy_data.csv': "CSV",
+            'synthetic_pharmacy_data.xlsx': "Excel"
+        }
+        # A stale Parquet copy that failed to refresh must not shadow the CSV/Excel source
+        if not ensure_sample_parquet():
+            del sample_formats[SAMPLE_PARQUET_PATH]
+        sample_path = next((path for path in sample_formats if os.path.exists(path)), None)
         
-        # If neither format works, show error
-        if not sample_data_loaded:
-            st.error("No sample data available. Please upload your pharmacy data to get started.")
+        # If no format is available, show error
+        if sample_path is None:
             st.error("No sample data available. Please upload your pharmacy data to get started.")
             st.info("""
             **Required columns:** TransactionID, Date, PatientID, ServiceType, MedicationCategory, Quantity, UnitPrice, InsuranceUsed, TotalPrice
             """)
             return
+        
+        # Modification time so a regenerated sample invalidates the caches
+        data_id = f"{sample_path}:{os.path.getmtime(sample_path)}"
+        df = load_data(sample_path, data_id)
+        if data_option == "View Sample Data":
+            st.sidebar.success(f"Sample data loaded ({sample_formats[sample_path]})")
     
     if df is None:
         return
     
+    months_available, first_date, last_date = month_index(df, data_id)
+    
     # Display data info
     st.sidebar.markdown("---")
     st.sidebar.subheader("Data Overview")
     st.sidebar.write(f"**Total Transactions:** {len(df):,}")
-    st.sidebar.write(f"**Date Range:** {df['Date'].min().strftime('%Y-%m-%d')} to {df['Date'].max().strftime('%Y-%m-%d')}")
+    st.sidebar.write(f"**Date Range:** {first_date.strftime('%Y-%m-%d')} to {last_date.strftime('%Y-%m-%d')}")
     st.sidebar.write(f"**Total Revenue:** ${df['Revenue'].sum():,.2f}")
     st.sidebar.write(f"**Unique Patients:** {df['PatientID'].nunique():,}")
     
@@ -779,8 +1220,7 @@ def main():
     st.sidebar.header("Filter Your Data")
     
     # Month filter
-    months_available = sorted(df['Month'].unique())
-    month_names = [str(month) for month in months_available]
+    month_names = [month.strftime('%b %Y') for month in months_available]
     
     selected_month_idx = st.sidebar.selectbox(
         "Select Month",
@@ -791,7 +1231,7 @@ def main():
     selected_month = months_available[selected_month_idx]
     
     # Filter data by selected month
-    filtered_df = df[df['Month'] == selected_month]
+    filtered_df = df[df['Month'].to_numpy() == selected_month.to_datetime64()]
     
     # Date range filter within the month
     min_date = filtered_df['Date'].min()
@@ -805,10 +1245,10 @@ def main():
     )
     
     if len(date_range) == 2:
-        filtered_df = filtered_df[
-            (filtered_df['Date'] >= pd.to_datetime(date_range[0])) & 
-            (filtered_df['Date'] <= pd.to_datetime(date_range[1]))
-        ]
+        start_date = np.datetime64(date_range[0])
+        end_date = np.datetime64(date_range[1])
+        dates = filtered_df['Date'].to_numpy()
+        filtered_df = filtered_df.iloc[(dates >= start_date) & (dates <= end_date)]
     
     # Key Metrics Dashboard
     st.header("Performance Metrics")
@@ -819,7 +1259,8 @@ def main():
         st.metric("Total Revenue", f"${total_revenue:,.2f}")
     
     with col2:
-        total_transactions = filtered_df['TransactionID'].nunique()
+        # TransactionID is unique per row
+        total_transactions = len(filtered_df)
         st.metric("Total Transactions", f"{total_transactions:,}")
     
     with col3:
@@ -833,119 +1274,15 @@ def main():
     # Pharmacy specific metrics
     create_pharmacy_specific_metrics(filtered_df)
     
+    # Cached aggregates and charts are keyed on the source and filters
+    filter_key = (data_id, month_names[selected_month_idx], tuple(date_range))
+    
     # Check data availability and create dynamic tabs
     data_availability = check_data_availability(filtered_df)
-    
-    # Build tab list based on available data
-    tab_configs = [
-        ("Revenue Analysis", True),  # Always available
-        ("Prescription vs OTC", True),  # Always available
-        ("Top Categories", True),  # Always available
-    ]
-    
-    # Add conditional tabs
-    if data_availability['compliance']:
-        tab_configs.append(("Patient Compliance", True))
-    
-    if data_availability['seasonal'] or len(filtered_df[filtered_df['InsuranceUsed'].isin(['Yes', 'No'])]) > 0:
-        tab_configs.append(("Business Patterns", True))
-    
-    if data_availability['clinical']:
-        tab_configs.append(("Clinical Services", True))
-    
-    # Create tabs dynamically
-    tab_names = [config[0] for config in tab_configs]
-    tabs = st.tabs(tab_names)
-    
-    # Content for each tab
-    for i, (tab_name, _) in enumerate(tab_configs):
-        with tabs[i]:
-            if tab_name == "Revenue Analysis":
-                st.header("Sales Trend Analysis")
-                st.plotly_chart(create_daily_sales_trend(filtered_df), use_container_width=True)
-            
-            elif tab_name == "Prescription vs OTC":
-                st.header("Prescription vs OTC Sales Analysis")
-                create_prescription_otc_chart(filtered_df)
-            
-            elif tab_name == "Top Categories":
-                st.header("Top Medications and Categories")
-                create_top_medications_chart(filtered_df)
-                
-                # Detailed category performance table
-                st.subheader("Category Performance Details")
-                category_details = filtered_df.groupby('MedicationCategory').agg({
-                    'TotalPrice': ['sum', 'mean'],
-                    'Quantity': 'sum',
-                    'TransactionID': 'count',
-                    'PatientID': 'nunique'
-                }).round(2)
-                
-                category_details.columns = ['Total Revenue', 'Avg Revenue', 'Total Quantity', 'Transactions', 'Unique Patients']
-                category_details = category_details.sort_values('Total Revenue', ascending=False)
-                
-                st.dataframe(
-                    category_details.style.format({
-                        'Total Revenue': '${:,.2f}',
-                        'Avg Revenue': '${:.2f}',
-                        'Total Quantity': '{:,}',
-                        'Transactions': '{:,}',
-                        'Unique Patients': '{:,}'
-                    }),
-                    use_container_width=True
-                )
-            
-            elif tab_name == "Patient Compliance":
-                st.header("Patient Refill Compliance Analysis")
-                create_compliance_charts(filtered_df)
-            
-            elif tab_name == "Business Patterns":
-                st.header("Business Patterns Analysis")
-                
-                # Insurance Analysis Section
-                if len(filtered_df[filtered_df['InsuranceUsed'].isin(['Yes', 'No'])]) > 0:
-                    st.subheader("Insurance vs Cash Pay Trends")
-                    create_insurance_analysis(filtered_df)
-                
-                # Seasonal Analysis Section
-                if data_availability['seasonal']:
-                    st.subheader("Seasonal Health Condition Patterns")
-                    create_seasonality_analysis(filtered_df)
-            
-            elif tab_name == "Clinical Services":
-                st.header("Clinical Services Performance")
-                create_clinical_services_analysis(filtered_df)
+    render_tabs(filtered_df, data_availability, filter_key)
     
     # Raw Data Section
-    with st.expander("View Detailed Transaction Data"):
-        st.subheader("Recent Pharmacy Transactions")
-        display_df = filtered_df.sort_values('Date', ascending=False)
-        
-        # Show formatted transaction data
-        formatted_display = display_df[['Date', 'PatientID', 'ServiceType', 'MedicationCategory', 
-                                       'Quantity', 'UnitPrice', 'TotalPrice', 'InsuranceUsed']].head(50)
-        
-        st.dataframe(
-            formatted_display.style.format({
-                'UnitPrice': '${:.2f}',
-                'TotalPrice': '${:.2f}',
-                'Date': lambda x: x.strftime('%Y-%m-%d')
-            }),
-            use_container_width=True,
-            height=400
-        )
-        
-        if len(display_df) > 50:
-            st.info(f"Showing first 50 of {len(display_df):,} transactions. Download complete report below.")
-        
-        # Download button
-        csv = filtered_df.to_csv(index=False)
-        st.download_button(
-            label="Download Pharmacy Analytics Report (CSV)",
-            data=csv,
-            file_name=f"clarus_pharmacy_analytics_{selected_month}.csv",
-            mime="text/csv"
-        )
+    render_raw_data(filtered_df, selected_month, filter_key)
     
     # Footer
     st.markdown("---")